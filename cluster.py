@@ -1,4 +1,9 @@
+import os
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+STORE_DIR = "/mnt/sda4/node"
 
 def ssh_cmd(node, cmd, check_rc=True):
     subprocess.run(
@@ -18,15 +23,42 @@ class Node:
     def kill(self):
 
         # hard shutdown, then wipe disk
-        ssh_cmd(self, "pkill -9 cockroach ; pkill -9 cockroach ; sudo rm -r /mnt/sda4/node", False)
+        ssh_cmd(self, f"pkill -9 cockroach ; pkill -9 cockroach ; sudo rm -r {STORE_DIR}", False)
+
+    def harvest(self, dest, artifacts):
+
+        # Pull the node's logs (which live in the store directory, so kill()
+        # would wipe them) plus any store artifacts matching the given globs
+        # into dest. Everything is compressed on the node first. Returns the
+        # archive size in bytes and how long the whole thing took.
+        begin = time.monotonic()
+        archive = f"/tmp/harvest-{self.name}.tar.gz"
+        local = f"{dest}/harvest.tar.gz"
+        paths = " ".join(["logs"] + artifacts)
+
+        # Globs that match nothing are dropped so tar doesn't bail out.
+        ssh_cmd(self, f"cd {STORE_DIR} && tar czf {archive} $(ls -d {paths} 2>/dev/null)", False)
+
+        os.makedirs(dest, exist_ok=True)
+        subprocess.run(["sudo", "scp", "-q", f"root@{self.name}:{archive}", local], stdout=subprocess.DEVNULL)
+        ssh_cmd(self, f"rm -f {archive}", False)
+
+        if not os.path.exists(local):
+            return {"bytes": 0, "seconds": time.monotonic() - begin}
+
+        size = os.path.getsize(local)
+        subprocess.run(["tar", "xzf", local, "-C", dest])
+        subprocess.run(["sudo", "rm", local])
+
+        return {"bytes": size, "seconds": time.monotonic() - begin}
 
     def start(self, nodes):
         print(f"starting node {self.name}")
         # construct command
         join_str = ",".join([f"{node.get_name()}:26257" for node in nodes])
         cmd = "cockroach start --insecure"
-        cmd += " --store=/mnt/sda4/node" # can change this
-        cmd += " --http-addr=localhost:8080"
+        cmd += f" --store={STORE_DIR}" # can change this
+        cmd += f" --http-addr={self.name}:8080" # reachable by the metrics scraper
         cmd += f" --listen-addr={self.name}:26257"
         cmd += " --join=" + join_str
         cmd += " --background"
@@ -52,6 +84,20 @@ class Cluster:
         for node in self.nodes:
             node.kill()
 
+    def harvest(self, dest, artifacts=None):
+        # Harvest every node at once into dest/<node>/. Returns per-node
+        # transfer sizes and times.
+        if artifacts is None:
+            artifacts = []
+
+        def harvest_node(node):
+            return node.harvest(f"{dest}/{node.get_name()}", artifacts)
+
+        with ThreadPoolExecutor(max_workers=len(self.nodes)) as pool:
+            results = pool.map(harvest_node, self.nodes)
+
+        return {node.get_name(): result for node, result in zip(self.nodes, results)}
+
     def get_nodes(self):
         return self.nodes
 
@@ -0,0 +1,253 @@
+# Compares a candidate experiment directory against a baseline one and exits
+# non-zero if the candidate is measurably worse. Workloads are matched by
+# their flags. We look at both the aggregate statistics and the full
+# per-window series, so this is meant to be run right after main.py when
+# trying out a new CockroachDB build.
+
+import argparse
+import glob
+import os
+import sys
+import numpy as np
+import yaml
+
+from processing import STEP_NANO, block_means, grouped_percentiles, permutation_min_p, permutation_test
+
+# Per-window series we compare, and whether a bigger number is better.
+SERIES = {
+    "throughput": True,
+    "p50": False,
+    "p90": False,
+    "p99": False,
+    "outstanding": False,
+}
+
+# Same, for the aggregate statistics.
+AGGREGATES = {
+    "throughput": True,
+    "latency": False,
+    "outstanding": False,
+}
+
+def load_workloads(directory):
+    # Return {flags key: workload YAML} for every workload in directory. Each
+    # workload also gets the path of its raw trace under "trace-file".
+    workloads = {}
+    for file in glob.glob(os.path.join(directory, "*.yaml")):
+        with open(file) as f:
+            workload = yaml.full_load(f)
+
+        stem = os.path.basename(file)[:-5]
+        workload["trace-file"] = os.path.join(directory, "traces", stem + ".txt")
+
+        key = tuple(sorted((flag, str(value)) for flag, value in workload["flags"].items()))
+        workloads[key] = workload
+
+    return workloads
+
+def steady_windows(ts):
+    # Window bounds [lo, hi) of the steady-state interval process_timeseries
+    # recorded, so ramp-up, drain and the padded tail don't get compared. 
+    # Older files don't have it; use every real window (window 0 is fake).
+    if "steady-state" not in ts:
+        return 1, len(ts["seconds"])
+
+    step = ts["seconds"][1]
+    lo = int(round(ts["steady-state"]["start"]/step)) + 1
+    hi = int(round(ts["steady-state"]["end"]/step)) + 1
+
+    return lo, hi
+
+def block_percentiles(series, block, q):
+    # Like block_means, but the q-th percentile of each block.
+    series = np.asarray(series, dtype=float)
+    n_blocks = len(series)//block
+
+    return np.percentile(series[:n_blocks*block].reshape(n_blocks, block), q, axis=1)
+
+def latency_blocks(path, lo, hi, block):
+
+    # Request latencies from a raw trace, grouped into blocks of `block`
+    # windows (by start time) over the steady-state windows [lo, hi). Returns
+    # (block index per request, latency in ms, number of blocks), or None if
+    # the trace isn't there. Requests that never finished are left out.
+    if not os.path.exists(path):
+        return None
+
+    trace = np.loadtxt(path, usecols=(0, 1), ndmin=2)
+    start = trace[:, 0]
+    finish = trace[:, 1]
+
+    windows = np.maximum(np.ceil((start - start[0])/STEP_NANO), 1)
+    n_blocks = (hi - lo)//block
+    keep = (windows >= lo) & (windows < lo + n_blocks*block) & np.isfinite(finish)
+
+    blocks = ((windows[keep] - lo)//block).astype(int)
+    latencies = (finish[keep] - start[keep])/(10**6)
+
+    return blocks, latencies, n_blocks
+
+def compare_stat(name, base, cand, base_samples, cand_samples, higher_is_better, args):
+
+    # Compare one statistic. base/cand are the numbers we report; the samples
+    # (if any) are what we run the permutation test on. Returns a report row
+    # and whether this counts as a regression.
+    if base == 0:
+        change = 0.0 if cand == 0 else np.inf
+    else:
+        change = (cand - base)/abs(base)
+
+    worse = -change if higher_is_better else change
+
+    # Only test if the test could actually come out significant: with very 
+    # few samples (e.g. 3 repeats per side) p can never drop below alpha.
+    p = None
+    if base_samples is not None and len(base_samples) > 1 and len(cand_samples) > 1:
+        if permutation_min_p(len(base_samples), len(cand_samples), args.permutations) < args.alpha:
+            p = permutation_test(base_samples, cand_samples, args.permutations)
+
+    # A change between two single numbers is mostly noise, so only a 
+    # significant change counts towards the exit code; untested changes are
+    # reported but don't fail the gate.
+    regressed = worse > args.threshold and p is not None and p < args.alpha
+
+    p_str = "n/a" if p is None else f"{p:.4f}"
+    if regressed:
+        verdict = "REGRESSION"
+    elif p is None and worse > args.threshold:
+        verdict = "worse (untested)"
+    elif -worse > args.threshold:
+        verdict = "improved"
+    else:
+        verdict = "ok"
+
+    row = f"  {name:<24}{base:>14.2f}{cand:>14.2f}{100*change:>+10.1f}%{p_str:>10}  {verdict}"
+
+    return row, regressed
+
+def compare_workload(base, cand, args):
+    rows = []
+    regressions = 0
+
+    base_lo, base_hi = steady_windows(base["ts"])
+    cand_lo, cand_hi = steady_windows(cand["ts"])
+
+    # Only the steady-state windows get compared.
+    def steady(workload, series, lo, hi):
+        values = np.array(workload["ts"][series][lo:hi], dtype=float)
+        return values[~np.isnan(values)]
+
+    # Raw latencies, only loaded if we need them.
+    latencies = {}
+
+    repeated = ("repeats" in base and "repeats" in cand and permutation_min_p(len(base["repeats"]),
+        len(cand["repeats"]), args.permutations) < args.alpha)
+
+    # Aggregates. If both sides were repeated often enough to test, the 
+    # per-repeat values are the samples. Otherwise, we cut the steady-state interval into blocks of
+    # --block windows and take the same statistic per block: the percentile of
+    # the per-window series for throughput/outstanding, the percentile of the
+    # requests that started in the block (from the raw trace) for latency.
+    for stat, higher_is_better in AGGREGATES.items():
+        for percentile in base["aggregate"][stat]:
+            q = float(percentile[1:])
+            base_samples = None
+            cand_samples = None
+
+            if repeated:
+                base_samples = [r[stat][percentile] for r in base["repeats"]]
+                cand_samples = [r[stat][percentile] for r in cand["repeats"]]
+
+            elif stat == "latency":
+                if len(latencies) == 0:
+                    latencies["base"] = latency_blocks(base["trace-file"], base_lo, base_hi, args.block)
+                    latencies["cand"] = latency_blocks(cand["trace-file"], cand_lo, cand_hi, args.block)
+
+                if latencies["base"] is not None and latencies["cand"] is not None:
+                    base_samples = grouped_percentiles(*latencies["base"], [q])[q]
+                    cand_samples = grouped_percentiles(*latencies["cand"], [q])[q]
+
+            else:
+                base_samples = block_percentiles(steady(base, stat, base_lo, base_hi), args.block, q)
+                cand_samples = block_percentiles(steady(cand, stat, cand_lo, cand_hi), args.block, q)
+
+            row, regressed = compare_stat(f"{stat}.{percentile}",
+                base["aggregate"][stat][percentile], cand["aggregate"][stat][percentile],
+                base_samples, cand_samples, higher_is_better, args)
+            rows.append(row)
+            regressions += regressed
+
+    # Per-window series over the steady-state interval. Adjacent windows
+    # aren't independent, so the test runs on block means.
+    for series, higher_is_better in SERIES.items():
+        base_series = steady(base, series, base_lo, base_hi)
+        cand_series = steady(cand, series, cand_lo, cand_hi)
+
+        row, regressed = compare_stat(f"ts.{series} (mean)", base_series.mean(),
+            cand_series.mean(), block_means(base_series, args.block),
+            block_means(cand_series, args.block), higher_is_better, args)
+        rows.append(row)
+        regressions += regressed
+
+    return rows, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a candidate experiment for performance regressions against a baseline.")
+
+    parser.add_argument("baseline", help="baseline experiment directory")
+
+    parser.add_argument("candidate", help="candidate experiment directory")
+
+    parser.add_argument("--threshold", type=float, default=0.05,
+    help="relative change that counts as a regression (default 0.05)")
+
+    parser.add_argument("--alpha", type=float, default=0.05,
+    help="significance level for the permutation tests (default 0.05)")
+
+    parser.add_argument("--permutations", type=int, default=10000,
+    help="number of permutations per test")
+
+    parser.add_argument("--block", type=int, default=50,
+    help="windows per block when building samples to test (default 50, i.e. 5s)")
+
+    args = parser.parse_args()
+
+    baseline = load_workloads(args.baseline)
+    candidate = load_workloads(args.candidate)
+
+    # A wrong path or a crashed run must not look like "no regressions".
+    for directory, workloads in [(args.baseline, baseline), (args.candidate, candidate)]:
+        if len(workloads) == 0:
+            print(f"no workloads found in {directory}")
+            sys.exit(1)
+
+    regressions = 0
+    missing = 0
+    for key, base in sorted(baseline.items()):
+        name = ", ".join([f"{flag}={value}" for flag, value in key])
+        print(name)
+
+        if key not in candidate:
+            print("  MISSING: no matching workload in candidate")
+            missing += 1
+            continue
+
+        rows, n = compare_workload(base, candidate[key], args)
+        print(f"  {'statistic':<24}{'baseline':>14}{'candidate':>14}{'change':>11}{'p':>10}")
+        for row in rows:
+            print(row)
+
+        regressions += n
+
+    for key in candidate.keys() - baseline.keys():
+        print(", ".join([f"{flag}={value}" for flag, value in key]))
+        print("  no matching workload in baseline")
+
+    print("p = n/a: too few samples (or no raw trace) for a test; such rows don't fail the gate")
+    print(f"{regressions} significant regression(s) over a {100*args.threshold:.1f}% threshold, "
+        f"{missing} baseline workload(s) missing from candidate")
+    if regressions > 0 or missing > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# Host resource sampler. This gets copied to every database and workload node
+# and runs alongside the workload, so it only uses the standard library. Every
+# interval it reads /proc/stat, /proc/diskstats and /proc/net/dev and appends a
+# fixed-size record of raw counters to a binary log. Turning counters into
+# rates is left to processing.host_timeseries on the workload node.
+
+import argparse
+import struct
+import time
+
+# Every record is this many little-endian uint64s, in this order. Timestamps
+# are UNIX time in nanoseconds, same as the request traces.
+FIELDS = [
+    "ts",
+    # aggregate "cpu" line of /proc/stat, in jiffies
+    "cpu_user", "cpu_nice", "cpu_system", "cpu_idle", "cpu_iowait", "cpu_irq",
+    "cpu_softirq", "cpu_steal",
+    # one device from /proc/diskstats
+    "disk_reads", "disk_read_sectors", "disk_writes", "disk_write_sectors", "disk_io_ms",
+    # summed over every interface except loopback, from /proc/net/dev
+    "net_rx_bytes", "net_tx_bytes",
+]
+
+RECORD = struct.Struct("<" + "Q"*len(FIELDS))
+
+def read_cpu(f):
+    f.seek(0)
+    line = f.readline()
+    return [int(n) for n in line.split()[1:9]]
+
+def read_disk(f, disk):
+    f.seek(0)
+    for line in f:
+        s = line.split()
+        if s[2] == disk:
+            # reads completed, sectors read, writes completed, sectors written,
+            # time spent doing I/O (ms)
+            return [int(s[3]), int(s[5]), int(s[7]), int(s[9]), int(s[12])]
+
+    return [0]*5
+
+def read_net(f):
+    f.seek(0)
+    rx = 0
+    tx = 0
+
+    # First two lines are headers.
+    for line in f.readlines()[2:]:
+        iface, counters = line.split(":", 1)
+        if iface.strip() == "lo":
+            continue
+
+        s = counters.split()
+        rx += int(s[0])
+        tx += int(s[8])
+
+    return [rx, tx]
+
+def sample(path, interval, duration, disk):
+    stat = open("/proc/stat")
+    diskstats = open("/proc/diskstats")
+    netdev = open("/proc/net/dev")
+
+    end = time.monotonic() + duration
+    with open(path, "wb") as out:
+        while time.monotonic() < end:
+            tick = time.monotonic()
+
+            values = [time.time_ns()] + read_cpu(stat) + read_disk(diskstats, disk) + read_net(netdev)
+            out.write(RECORD.pack(*values))
+            out.flush()
+
+            time.sleep(max(0, interval - (time.monotonic() - tick)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Low-overhead CPU/disk/network sampler.")
+
+    parser.add_argument("out", help="binary log to write")
+
+    parser.add_argument("--interval", type=float, default=0.1,
+    help="seconds between samples")
+
+    parser.add_argument("--duration", type=float, default=60,
+    help="seconds to sample for")
+
+    parser.add_argument("--disk", default="sda4",
+    help="device name in /proc/diskstats")
+
+    args = parser.parse_args()
+    sample(args.out, args.interval, args.duration, args.disk)
+
+if __name__ == "__main__":
+    main()
@@ -11,5 +11,8 @@ if __name__ == "__main__":
     for node in c.get_nodes():
         if (node.get_name() in conf["workload-nodes"]):
             os.system(f"sudo ssh -t {node.get_name()} 'rm start.txt end.txt'")
+
+        # stop host samplers, if any are still going
+        os.system(f"sudo ssh -t {node.get_name()} 'pkill -f hostsample.py ; rm hostsample.bin'")
     os.system("sudo rm start.txt end.txt")
     c.kill()
@@ -4,15 +4,160 @@ import subprocess
 import time
 import yaml
 from cluster import Cluster
+from concurrent.futures import ThreadPoolExecutor
+from metrics import MetricsScraper
 
 from pprint import pprint
 from pqueue import PriorityQueue
-from processing import process_timeseries
+from processing import host_timeseries, intervals_converged, latency_heatmap, merge_repeats, process_timeseries
 from tqdm import tqdm
 
+# A percentile bootstrap over just a couple of runs is little more than the
+# [min, max] of those runs, so we never consider a workload converged before it
+# has been run at least this many times.
+MIN_CI_REPEATS = 5
+
 def ssh_cmd(node_name, cmd):
     os.system(f"sudo ssh -tt {node_name} '{cmd}' &")
 
+def parse_duration(duration):
+    # Durations are strings like "30s" or "2m", or bare numbers of seconds. 
+    # Returns seconds. This means don't run workloads under 1 second!
+    if isinstance(duration, (int, float)):
+        return duration
+
+    units = {"s": 1, "m": 60}
+    duration = str(duration).strip()
+    try:
+        if duration[-1:] in units:
+            return float(duration[:-1])*units[duration[-1]]
+        return float(duration)
+    except ValueError:
+        raise ValueError(f"can't parse duration {duration!r}: use seconds, or a number followed by s or m")
+
+def start_host_samplers(hosts, sampling, duration):
+
+    # Ship hostsample.py to every node and start it in the background. It stops
+    # by itself, but collect_host_samples will usually kill it first.
+    interval = sampling.get("interval", 0.1)
+    disk = sampling.get("disk", "sda4")
+    cmd = f"python3 hostsample.py hostsample.bin --interval={interval} --duration={duration} --disk={disk}"
+
+    def start(node):
+        subprocess.run(["sudo", "scp", "hostsample.py", f"{node}:"], stdout=subprocess.DEVNULL)
+        ssh_cmd(node, cmd)
+
+    with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+        list(pool.map(start, hosts))
+
+def collect_host_samples(hosts, out_dir):
+
+    # Stop the samplers and pull every node's log into out_dir/<node>.bin. The
+    # nodes are independent, so we do all of them at once.
+    os.system("mkdir -p " + out_dir)
+
+    def collect(node):
+        subprocess.run(["sudo", "ssh", node, "pkill -f hostsample.py"], stdout=subprocess.DEVNULL)
+        subprocess.run(["sudo", "scp", f"{node}:hostsample.bin", f"{out_dir}/{node}.bin"], stdout=subprocess.DEVNULL)
+        subprocess.run(["sudo", "ssh", node, "rm hostsample.bin"], stdout=subprocess.DEVNULL)
+
+    with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+        list(pool.map(collect, hosts))
+
+def run_workload(node_names, workload_nodes, sql_stmts, init_strings, cmd, flags, duration, 
+    scraper, sampling, host_dir, artifacts, log_dir):
+
+    # Run a single workload on a fresh cluster and return its merged trace,
+    # along with how much was harvested from each node. Server-side metrics
+    # are scraped into scraper while the workload runs. If sampling is set, 
+    # every node's CPU/disk/network usage is sampled as well and the logs end
+    # up in host_dir. Before the cluster is torn down, node logs and the given
+    # store artifacts are copied into log_dir.
+    hosts = node_names + workload_nodes
+    cluster = Cluster(node_names)
+    cluster.start()
+
+    for stmt in sql_stmts:
+        os.system(f"cockroach sql --insecure --host=node-0:26257 --execute '{stmt}'")
+
+    # Initialize workload
+    os.system("cockroach workload init kv " + " ".join(init_strings))
+
+    # Run workload:
+    print("running experiment w/ flags:")
+    print(", ".join([f"{f}={v}" for f, v in flags.items()]))
+
+    if sampling is not None:
+        start_host_samplers(hosts, sampling, duration + 60)
+
+    # First run it on all the other workload nodes that aren't this one:
+    for node in workload_nodes:
+        ssh_cmd(node, cmd)
+    # then run it on this one:
+    # os.system(cmd)
+
+    scraper.start()
+
+    print("sleeping")
+    time.sleep(duration + 30)
+    print("finished sleeping")
+
+    scraper.stop()
+
+    if sampling is not None:
+        collect_host_samples(hosts, host_dir)
+    # map of request ids to request start and finish times
+    timestamps = []
+    
+    # for computing unfinished request #
+    unfinished = 0
+    for node_idx, node in enumerate(workload_nodes):
+        print(f"grabbing trace files from {node}")
+        os.system(f"sudo scp {node}:start.txt .")
+        os.system(f"sudo scp {node}:end.txt .")
+        os.system(f"sudo ssh -t {node} 'rm start.txt end.txt'")
+
+        requests = {}
+
+        with open("start.txt") as started_file:
+            for line in started_file:
+                req_id, ts = [int(s) for s in line.split()]
+                # Keep track of which workload node issued the request, so we
+                # can break the results down per client later.
+                requests[req_id] = [ts, np.inf, node_idx]
+                unfinished += 1
+        
+        with open("end.txt") as finished_file:
+            for line in finished_file:  
+                req_id, ts = [int(s) for s in line.split()]
+                requests[req_id][1] = ts
+                unfinished -= 1
+
+        print(f"{unfinished} requests never finished.")
+
+        # IDs are ALMOST sorted by time. Unfortunately, concurrency is cruel
+        # and sometimes a goroutine ends up determining its ID, pausing, and
+        # only taking the timestamp later, after another goroutine. So we 
+        # have to sort.
+        requests = list(requests.values())
+
+        for r in requests:
+            timestamps.append(r)
+        
+        os.system("sudo rm start.txt end.txt")
+    
+    timestamps.sort(key=lambda x: x[0])
+
+    # Killing the cluster wipes the store directory, logs included, so grab
+    # them first.
+    print(f"harvesting logs into {log_dir}")
+    harvested = cluster.harvest(log_dir, artifacts)
+
+    cluster.kill()
+    time.sleep(2)
+
+    return timestamps, harvested
+
 def run():
 
     # Get everything we need from config.yaml:
@@ -27,6 +172,45 @@ def run():
     session_vars = conf["session-vars"]
     workload_nodes = conf["workload-nodes"]
 
+    # Repetition settings. Older configs don't have this section, in which case
+    # every workload runs exactly once.
+    repetitions = conf.get("repetitions", {})
+    max_repeats = repetitions.get("max", 1)
+    if "min" in repetitions:
+        print(f"repetitions.min is ignored; convergence is checked from {MIN_CI_REPEATS} repeats on")
+    if 1 < max_repeats < MIN_CI_REPEATS:
+        print(f"warning: repetitions.max is below {MIN_CI_REPEATS}, so every workload runs "
+            f"{max_repeats} times without a convergence check")
+    target_width = repetitions.get("target-width", 0.05)
+    confidence = repetitions.get("confidence", 0.95)
+    ci_stats = repetitions.get("stats", ["latency.p99", "throughput.p50"])
+
+    # Server-side metrics to scrape from each node during a run, if any.
+    metrics = conf.get("metrics", {})
+    metric_names = metrics.get("names", [])
+    metric_interval = metrics.get("interval", 1.0)
+
+    # Host resource sampling on every node. Disabled if the section is missing.
+    sampling = conf.get("host-sampling")
+
+    # Fixed warmup/cooldown to trim before computing aggregates. If neither is
+    # set, the steady-state interval is detected automatically.
+    steady = conf.get("steady-state") or {}
+    warmup = parse_duration(steady["warmup"]) if "warmup" in steady else None
+    cooldown = parse_duration(steady["cooldown"]) if "cooldown" in steady else None
+    steady_window = steady.get("window", 10)
+    steady_tolerance = steady.get("tolerance", 0.1)
+
+    # Store artifacts (globs relative to the store directory) to harvest from
+    # every node along with its logs.
+    artifacts = conf.get("harvest", {}).get("artifacts", [])
+
+    # Latency heatmap buckets.
+    heatmap = conf.get("heatmap", {})
+    heatmap_buckets = heatmap.get("buckets", 64)
+    heatmap_min_ms = heatmap.get("min-ms", 0.01)
+    heatmap_max_ms = heatmap.get("max-ms", 10**4)
+
     # Figure out connection strings. These stay the same during all workloads.
     # We assume all nodes are listening on port 26257.
 
@@ -43,21 +227,20 @@ def run():
     conn_strings = [f"'{s}'" for s in conn_strings]
     
     os.system("mkdir -p " + name + "/traces")
+    os.system("mkdir -p " + name + "/heatmaps")
 
     for workload_config in configs:
         cmd = "cockroach workload run kv "
         flags = defaults
 
-        cluster = Cluster(node_names)
-        cluster.start()
-
-        for stmt in sql_stmts:
-            os.system(f"cockroach sql --insecure --host=node-0:26257 --execute '{stmt}'")
-
         # Overwrite default flags with flags from workload config:
         for key in workload_config.keys():
             flags[key] = workload_config[key]
 
+        # cockroach wants a unit on --duration; a bare number means seconds.
+        if type(flags.get("duration")) in (int, float):
+            flags["duration"] = f"{flags['duration']}s"
+
         for flag, value in flags.items():
             if type(value) is bool:
                 if value:
@@ -73,78 +256,79 @@ def run():
 
         cmd += " ".join(conn_strings)
 
-        # Initialize workload
-        os.system("cockroach workload init kv " + " ".join(init_strings))
-
-        # Run workload:
-        print("running experiment w/ flags:")
-        print(", ".join([f"{f}={v}" for f, v in flags.items()]))
-
-        # First run it on all the other workload nodes that aren't this one:
-        for node in workload_nodes:
-            ssh_cmd(node, cmd)
-        # then run it on this one:
-        # os.system(cmd)
         # "duration" is actually a string, like "30s"
-        duration = flags["duration"] 
-
-        # This means don't run workloads under 1 second!
-        time_unit = duration[-1]
-        if time_unit == "s":
-            duration = int(duration[:-1])
-        elif time_unit == "m":
-            duration = int(duration[:-1])*60
-
-        print("sleeping")
-        time.sleep(duration + 30)
-        print("finished sleeping")
-        # map of request ids to request start and finish times
-        timestamps = []
-        
-        # for computing unfinished request #
-        unfinished = 0
-        for node in workload_nodes:
-            print(f"grabbing trace files from {node}")
-            os.system(f"sudo scp {node}:start.txt .")
-            os.system(f"sudo scp {node}:end.txt .")
-            os.system(f"sudo ssh -t {node} 'rm start.txt end.txt'")
-
-            requests = {}
-
-            with open("start.txt") as started_file:
-                for line in started_file:
-                    req_id, ts = [int(s) for s in line.split()]
-                    requests[req_id] = [ts, np.Inf]
-                    unfinished += 1
-            
-            with open("end.txt") as finished_file:
-                for line in finished_file:  
-                    req_id, ts = [int(s) for s in line.split()]
-                    requests[req_id][1] = ts
-                    unfinished -= 1
-
-            print(f"{unfinished} requests never finished.")
-
-            # IDs are ALMOST sorted by time. Unfortunately, concurrency is cruel
-            # and sometimes a goroutine ends up determining its ID, pausing, and
-            # only taking the timestamp later, after another goroutine. So we 
-            # have to sort.
-            requests = list(requests.values())
-
-            for r in requests:
-                timestamps.append(r)
-            
-            os.system("sudo rm start.txt end.txt")
-        
-        timestamps.sort(key=lambda x: x[0])
+        duration = parse_duration(flags["duration"])
 
         # The "naming convention" (if you can call it that) is pretty dumb 
         # here. We just name the trace after the workload-specific flags 
         # that were used to create it.
         exp_name = "_".join([flag + str(value) for flag, value in workload_config.items()])
-        
-        # Process the trace into a YAML file:
-        timeseries, aggregate_data = process_timeseries(np.array(timestamps), duration)
+
+        # Run the workload until the bootstrap intervals of the chosen 
+        # aggregates are narrow enough, or we run out of repeats. With the
+        # default settings this is exactly one run.
+        repeats = []
+        intervals = {}
+        harvest = {}
+        while len(repeats) < max_repeats:
+            # Only the first repeat keeps the plain name, so single runs look
+            # exactly like they used to.
+            trace_name = exp_name if len(repeats) == 0 else f"{exp_name}-{len(repeats)}"
+            host_dir = f"{name}/hosts/{trace_name}"
+
+            log_dir = f"{name}/logs/{trace_name}"
+
+            scraper = MetricsScraper(node_names, metric_names, metric_interval)
+            timestamps, harvest[trace_name] = run_workload(node_names, workload_nodes, sql_stmts, 
+                init_strings, cmd, flags, duration, scraper, sampling, host_dir, artifacts, log_dir)
+
+            # Process the trace into a YAML file:
+            trace = np.array(timestamps)
+            timeseries, aggregate_data = process_timeseries(trace, duration, workload_nodes, 
+                warmup, cooldown, steady_window, steady_tolerance)
+            repeats.append(aggregate_data)
+
+            # The latency heatmap is too big for the YAML file, so it gets its
+            # own file; the YAML just points at it (relative to the experiment
+            # directory).
+            counts, edges = latency_heatmap(trace, trace[0][0], len(timeseries["seconds"]),
+                heatmap_buckets, heatmap_min_ms, heatmap_max_ms)
+            np.savez_compressed(f"{name}/heatmaps/{trace_name}.npz", counts=counts, edges=edges)
+            timeseries["heatmap"] = f"heatmaps/{trace_name}.npz"
+
+            # Requests slower than max-ms, or that never finished inside the
+            # run, only show up in the overflow bucket.
+            timeseries["heatmap-overflow"] = int(counts[:, -1].sum())
+
+            if len(metric_names) > 0:
+                timeseries["metrics"] = scraper.aligned(timestamps[0][0], len(timeseries["seconds"]))
+                timeseries["metric-rates"] = sorted(scraper.counters)
+
+            if sampling is not None:
+                timeseries["hosts"] = {}
+                for node in node_names + workload_nodes:
+                    if os.path.exists(f"{host_dir}/{node}.bin"):
+                        timeseries["hosts"][node] = host_timeseries(f"{host_dir}/{node}.bin", 
+                            timestamps[0][0], len(timeseries["seconds"]))
+
+            with open("{}/traces/{}.txt".format(name, trace_name), "w") as trace:
+                # Convert everything back to a string and write out to file:
+                lines = []
+                for start, finish, node_idx in timestamps:
+                    lines.append(f"{start}\t{finish}\t{workload_nodes[node_idx]}\n")
+
+                trace.writelines(lines)
+
+            if len(repeats) >= MIN_CI_REPEATS:
+                aggregate_data, intervals = merge_repeats(repeats, ci_stats, confidence)
+                if intervals_converged(aggregate_data, intervals, target_width):
+                    break
+
+        # If we ran out of repeats before we could test for convergence, still
+        # report the mean over all repeats (and the, probably wide, intervals).
+        if len(repeats) > 1 and len(repeats) < MIN_CI_REPEATS:
+            aggregate_data, intervals = merge_repeats(repeats, ci_stats, confidence)
+
         print(exp_name + ":")
         pprint(aggregate_data)
 
@@ -154,20 +338,15 @@ def run():
                 "name": name,
                 "flags": flags,
                 "aggregate": aggregate_data,
-                "ts": timeseries
+                "ts": timeseries,
+                "harvest": harvest
             }
-            yaml.dump(exp_data, data_file, default_flow_style=None, width=80)
 
-        with open("{}/traces/{}.txt".format(name, exp_name), "w") as trace:
-            # Convert everything back to a string and write out to file:
-            lines = []
-            for start, finish in requests:
-                lines.append(f"{start}\t{finish}\n")
+            if len(repeats) > 1:
+                exp_data["repeats"] = repeats
+                exp_data["intervals"] = intervals
 
-            trace.writelines(lines)
-        
-        cluster.kill()
-        time.sleep(2)
+            yaml.dump(exp_data, data_file, default_flow_style=None, width=80)
 
 def main():
     run()
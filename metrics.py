@@ -0,0 +1,124 @@
+import http.client
+import threading
+import time
+import urllib.request
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from processing import align_samples
+
+def parse_prometheus(text, names):
+
+    # Pull the requested metrics out of a Prometheus text exposition. Lines
+    # look like
+    #   # TYPE raft_process_workingnanos counter
+    #   raft_process_workingnanos{store="1"} 1.234e+09
+    # Metrics that show up under several label sets (one per store, etc.) are
+    # summed together. Returns the values and the set of requested metrics
+    # that are declared as counters.
+    values = {}
+    counters = set()
+    for line in text.splitlines():
+        if line.startswith("# TYPE"):
+            s = line.split()
+            if len(s) == 4 and s[2] in names and s[3] == "counter":
+                counters.add(s[2])
+            continue
+
+        if len(line) == 0 or line[0] == "#":
+            continue
+
+        s = line.rsplit(maxsplit=1)
+        if len(s) != 2:
+            continue
+
+        metric = s[0].split("{")[0]
+        if metric in names:
+            values[metric] = values.get(metric, 0.0) + float(s[1])
+
+    return values, counters
+
+class MetricsScraper:
+
+    # Polls every node's metrics endpoint on a background thread while a
+    # workload is running. Nodes are scraped concurrently so one slow node
+    # doesn't skew the sampling times of the others.
+
+    def __init__(self, node_names, names, interval=1.0, port=8080, path="/_status/vars"):
+        self.node_names = node_names
+        self.names = set(names)
+        self.interval = interval
+        self.urls = {node: f"http://{node}:{port}{path}" for node in node_names}
+
+        # node -> list of (UNIX timestamp in ns, {metric: value})
+        self.samples = {node: [] for node in node_names}
+
+        # Metrics the endpoint declared as counters. These only go up, so 
+        # they're turned into per-second rates before being stored.
+        self.counters = set()
+
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def scrape(self, node):
+        # Any exception here would end the polling thread silently, so a bad
+        # scrape just skips this sample.
+        try:
+            with urllib.request.urlopen(self.urls[node], timeout=self.interval) as resp:
+                text = resp.read().decode()
+
+            values, counters = parse_prometheus(text, self.names)
+        except (OSError, http.client.HTTPException):
+            # Node isn't up yet or is overloaded (which can also cut a response
+            # short).
+            return
+        except ValueError:
+            # Garbled response.
+            return
+
+        self.samples[node].append((time.time_ns(), values))
+        self.counters |= counters
+
+    def poll(self):
+        with ThreadPoolExecutor(max_workers=len(self.node_names)) as pool:
+            while not self.stopped.is_set():
+                tick = time.monotonic()
+                list(pool.map(self.scrape, self.node_names))
+                self.stopped.wait(max(0, self.interval - (time.monotonic() - tick)))
+
+    def start(self):
+        if len(self.names) == 0:
+            return
+
+        self.thread = threading.Thread(target=self.poll, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def aligned(self, start_nano, n_windows):
+
+        # Return {node: {metric: [value per window]}}, with the windows lined
+        # up with process_timeseries output. Counters become per-second rates
+        # between consecutive samples, attributed to the end of the interval
+        # (like host_timeseries does); a counter reset gives NaN.
+        data = {}
+        for node, samples in self.samples.items():
+            data[node] = {}
+            sample_ts = np.array([ts for ts, _ in samples], dtype=float)
+
+            for metric in sorted(self.names):
+                values = np.array([v.get(metric, np.nan) for _, v in samples], dtype=float)
+
+                if metric in self.counters:
+                    rates = np.diff(values)/(np.diff(sample_ts)/10**9)
+                    rates[rates < 0] = np.nan
+                    series = align_samples(sample_ts[1:], rates, start_nano, n_windows)
+                else:
+                    series = align_samples(sample_ts, values, start_nano, n_windows)
+
+                data[node][metric] = [float(n) for n in series]
+
+        return data
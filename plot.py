@@ -50,18 +50,24 @@ def get_filepaths(rx):
 
 # TODO: this is stupid
 def get_flags_and_aggregate(file):
-    # Return a YAML file's 'flags' and 'aggregate' fields.
+    # Return a YAML file's 'flags', 'aggregate' and (if the workload was 
+    # repeated) 'intervals' fields.
     with open(file) as f:
         y = yaml.full_load(f)
-        return (y["flags"], y["aggregate"])
+        return (y["flags"], y["aggregate"], y.get("intervals", {}))
 
-def plot_exp_aggregate_stats(experiments, domain_stat, aggregate_stat, percentiles):
+def plot_exp_aggregate_stats(experiments, domain_stat, aggregate_stat, percentiles, intervals=None):
     fig = plt.figure(figsize=(2.5, 2.5))
 
     axes = plt.axes()
     #axes.set_ylim([0, 63])
     lines = {}
 
+    # Error bar extents below and above each point, if we have intervals.
+    errors = {}
+    if intervals is None:
+        intervals = {}
+
     for exp_name, exp_data in experiments.items():
 
         # Grab x-axis for experiment
@@ -69,6 +75,8 @@ def plot_exp_aggregate_stats(experiments, domain_stat, aggregate_stat, percentil
         rates = [i/1000 for i in rates]
         
         for rate, aggregate in exp_data.items():
+            exp_intervals = intervals.get(exp_name, {}).get(rate, {})
+
             for percentile in percentiles:
 
                 if len(experiments) > 1:
@@ -77,16 +85,28 @@ def plot_exp_aggregate_stats(experiments, domain_stat, aggregate_stat, percentil
                     exp_fullname = percentile
                 if exp_fullname not in lines.keys():
                     lines[exp_fullname] = ([0] + list(rates), [0])
+                    errors[exp_fullname] = ([0], [0])
 
-                lines[exp_fullname][1].append(aggregate[aggregate_stat][percentile])
+                y = aggregate[aggregate_stat][percentile]
+                lines[exp_fullname][1].append(y)
+
+                lo, hi = exp_intervals.get(aggregate_stat, {}).get(percentile, [y, y])
+                errors[exp_fullname][0].append(y - lo)
+                errors[exp_fullname][1].append(hi - y)
     
     # Now plot everything:
     style_idx = 0
     for line_name, line_data in lines.items():
         line_x, line_y = line_data
         #line_y = [l/1000 for l in line_y]
-        line, = axes.plot(line_x, line_y, marker=STYLES[style_idx], ms=6)
-        line.set_label(line_name)
+        line_err = errors[line_name]
+
+        if any(line_err[0]) or any(line_err[1]):
+            axes.errorbar(line_x, line_y, yerr=line_err, marker=STYLES[style_idx], ms=6,
+                capsize=2, label=line_name)
+        else:
+            line, = axes.plot(line_x, line_y, marker=STYLES[style_idx], ms=6)
+            line.set_label(line_name)
         style_idx += 1
 
         if style_idx == len(STYLES):
@@ -162,6 +182,10 @@ def main():
     #   2. the max-rate flags that were used for it
     #   3. aggregate data for latency/throughput/outstanding
     experiments = {}
+
+    # Bootstrap intervals for experiments whose workloads were repeated. Same
+    # layout as experiments.
+    intervals = {}
     
     # Go through each experiment directory.
     for directory in exp_dirs:
@@ -180,6 +204,7 @@ def main():
         x = [f[0][args.x] for f in data]
         y = [f[1] for f in data]
         experiments[directory] = {x[i]: y[i] for i in range(len(x))}
+        intervals[directory] = {f[0][args.x]: f[2] for f in data}
 
         # Now experiments looks like
         # {
@@ -188,7 +213,7 @@ def main():
 
     # Plot
     if graph_throughput:
-        fig = plot_exp_aggregate_stats(experiments, args.x, "throughput", throughput_percentiles)
+        fig = plot_exp_aggregate_stats(experiments, args.x, "throughput", throughput_percentiles, intervals)
         plt.title(args.title, wrap=True)
         plt.tight_layout()
 
@@ -198,7 +223,7 @@ def main():
             print(f"graph saved as {imgname}")
     
     if graph_latency:
-        fig = plot_exp_aggregate_stats(experiments, args.x, "latency", latency_percentiles)
+        fig = plot_exp_aggregate_stats(experiments, args.x, "latency", latency_percentiles, intervals)
         plt.title(args.title, wrap=True)
         plt.tight_layout()
 
@@ -208,7 +233,7 @@ def main():
             print(f"graph saved as {imgname}")
 
     if graph_outstanding:
-        fig = plot_exp_aggregate_stats(experiments, args.x, "outstanding", outstanding_percentiles)
+        fig = plot_exp_aggregate_stats(experiments, args.x, "outstanding", outstanding_percentiles, intervals)
         plt.title(args.title, wrap=True)
         plt.tight_layout()
 
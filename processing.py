@@ -1,18 +1,188 @@
+import math
 import os
 import numpy as np
 import subprocess
 import time
 import yaml
 
+from hostsample import FIELDS
 from pqueue import PriorityQueue
 from tqdm import tqdm
 
-def process_timeseries(timestamps, duration):
+# The length of the step window in nanoseconds.
+STEP_NANO = 10**8
+
+def grouped_percentiles(groups, values, n_groups, percentiles):
+
+    # Percentiles of values within each group, for all groups at once: sort by
+    # (group, value), then interpolate between order statistics inside each
+    # group's slice, the same way np.percentile does. Empty groups get 0, like
+    # empty windows do in process_timeseries.
+    order = np.lexsort((values, groups))
+    values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    offsets = np.cumsum(counts) - counts
+    empty = counts == 0
+
+    result = {}
+    for q in percentiles:
+        if len(values) == 0:
+            result[q] = np.zeros(n_groups)
+            continue
+
+        pos = offsets + np.maximum(counts - 1, 0)*q/100
+        lo = np.floor(pos).astype(int)
+        hi = np.ceil(pos).astype(int)
+        lo[empty] = 0
+        hi[empty] = 0
+
+        result[q] = values[lo] + (values[hi] - values[lo])*(pos - np.floor(pos))
+        result[q][empty] = 0
+
+    return result
+
+
+def finish_windows(finish, start_nano, n_windows):
+
+    # Index of the window each request finishes in. Window k covers 
+    # (start + (k-1)*step, start + k*step]; window 0 is the "fake" one that 
+    # ends at t=0 and always stays empty. Unfinished requests get n_windows.
+    finished = np.isfinite(finish)
+    windows = np.full(len(finish), n_windows)
+    windows[finished] = np.maximum(np.ceil((finish[finished] - start_nano)/STEP_NANO), 1)
+
+    return windows
+
+
+def latency_heatmap(timestamps, start_nano, n_windows, n_buckets=64, min_ms=0.01, max_ms=10**4):
+
+    # 2D histogram of request latencies: windows (by finish time, like
+    # node_timeseries) x log-spaced latency buckets, plus one explicit
+    # overflow bucket (the last column) for anything slower than max_ms, so
+    # timeouts and stuck requests don't pass for max_ms-latency requests.
+    # Requests that never finished, or finished after the last window, go in
+    # the overflow bucket of the window they started in, so they aren't lost.
+    # Latencies below min_ms land in the first bucket. One bincount over a
+    # combined (window, bucket) index does the whole thing.
+    edges = np.geomspace(min_ms, max_ms, n_buckets + 1)
+    windows = finish_windows(timestamps[:, 1], start_nano, n_windows)
+    latencies = (timestamps[:, 1] - timestamps[:, 0])/(10**6)
+
+    late = windows >= n_windows
+    windows[late] = np.maximum(np.ceil((timestamps[late, 0] - start_nano)/STEP_NANO), 1)
+    latencies[late] = np.inf
+
+    # Only requests that started after the last window are left out.
+    keep = windows < n_windows
+    buckets = np.clip(np.searchsorted(edges, latencies[keep], side="right") - 1, 0, n_buckets - 1)
+    buckets[latencies[keep] > max_ms] = n_buckets
+
+    n_columns = n_buckets + 1
+    counts = np.bincount(windows[keep].astype(int)*n_columns + buckets, minlength=n_windows*n_columns)
+
+    return counts.reshape(n_windows, n_columns).astype(np.uint32), edges
+
+
+def node_timeseries(timestamps, start_nano, n_windows, node_names):
+
+    # Per-client-node throughput, latency and outstanding series from a trace
+    # whose third column is the index (into node_names) of the workload node 
+    # that issued each request. Everything is computed in one grouped pass 
+    # keyed on (node, window) instead of running process_timeseries per node.
+    # Requests count towards the window they finish in (see finish_windows).
+    # Latency percentiles follow process_timeseries instead: only requests 
+    # that start and finish in the same window count, so with one node the
+    # percentiles match the global series.
+    n_nodes = len(node_names)
+    node = timestamps[:, 2].astype(int)
+    start = timestamps[:, 0]
+    finish = timestamps[:, 1]
+
+    start_window = np.maximum(np.ceil((start - start_nano)/STEP_NANO), 1)
+    finish_window = finish_windows(finish, start_nano, n_windows)
+
+    # Anything that starts or finishes after the last window is dropped from
+    # that count (and so stays outstanding until the end).
+    def per_window(windows):
+        keep = windows < n_windows
+        groups = node[keep]*n_windows + windows[keep].astype(int)
+        counts = np.bincount(groups, minlength=n_nodes*n_windows)
+        return counts.reshape(n_nodes, n_windows)
+
+    started = per_window(start_window)
+    completed = per_window(finish_window)
+
+    same = (start_window == finish_window) & (start_window < n_windows)
+    groups = node[same]*n_windows + start_window[same].astype(int)
+    latencies = (finish[same] - start[same])/(10**6)
+    percentiles = grouped_percentiles(groups, latencies, n_nodes*n_windows, [99, 90, 50])
+
+    throughput = completed/0.1
+    outstanding = np.cumsum(started, axis=1) - np.cumsum(completed, axis=1)
+
+    data = {}
+    for i, name in enumerate(node_names):
+        data[name] = {
+            "outstanding": [int(n) for n in outstanding[i]],
+            "throughput": [float(n) for n in throughput[i]],
+            "p99": [float(n) for n in percentiles[99].reshape(n_nodes, n_windows)[i]],
+            "p90": [float(n) for n in percentiles[90].reshape(n_nodes, n_windows)[i]],
+            "p50": [float(n) for n in percentiles[50].reshape(n_nodes, n_windows)[i]]
+        }
+
+    return data
+
+
+def steady_state(throughput, n_valid, window=10, tolerance=0.1):
+
+    # Find the steady part of a run by trimming the ramp-up at the start and
+    # any drain at the end. A window is "stable" if the rolling mean 
+    # throughput over `window` windows (i.e. 1s) around it is within
+    # tolerance of the run's median throughput, or within what the run's own
+    # window-to-window noise would explain, whichever is wider (otherwise a
+    # noisy but perfectly stationary run gets trimmed). The steady part runs
+    # from the first stretch of at least `window` stable windows through the
+    # end of the last such stretch; everything in between is kept, stable or
+    # not, so noisy windows in the middle of a run still count towards the 
+    # aggregates. Only windows [1, n_valid) are considered; window 0 is the
+    # fake one and anything past n_valid is padding. Returns window bounds 
+    # [lo, hi).
+    series = throughput[1:n_valid]
+    if len(series) < 2*window:
+        return 1, n_valid
+
+    # Centered rolling mean via cumulative sums.
+    sums = np.cumsum(np.concatenate([[0], series]))
+    half = window//2
+    lo_idx = np.clip(np.arange(len(series)) - half, 0, len(series))
+    hi_idx = np.clip(np.arange(len(series)) + window - half, 0, len(series))
+    rolling = (sums[hi_idx] - sums[lo_idx])/(hi_idx - lo_idx)
+
+    # Noise is estimated robustly (MAD) from the middle half of the run, where
+    # ramp-up and drain can't inflate it.
+    reference = np.median(series)
+    middle = series[len(series)//4:3*len(series)//4]
+    noise = 1.4826*np.median(np.abs(middle - np.median(middle)))
+    band = max(tolerance*reference, 3*noise/np.sqrt(window))
+    stable = np.abs(rolling - reference) <= band
+
+    # Runs of stable windows: run boundaries are where the padded mask flips.
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], stable.astype(int), [0]])))
+    starts, ends = edges[0::2], edges[1::2]
+    sustained = ends - starts >= window
+    if not np.any(sustained):
+        return 1, n_valid
+
+    # +1 because series starts at window 1.
+    return int(starts[sustained][0]) + 1, int(ends[sustained][-1]) + 1
+
+
+def process_timeseries(timestamps, duration, node_names=None, warmup=None, cooldown=None,
+    steady_window=10, steady_tolerance=0.1):
 
     # Constants:
     N_REQUESTS = len(timestamps)
     START_NANO = timestamps[0][0]
-    STEP_NANO = 10**8 # The length of the step window in nanoseconds.
 
     # Figure out how many windows we're going to collect data for:
     # (we add 1 because this is including the "fake" window that ends at t=0)
@@ -119,23 +289,43 @@ def process_timeseries(timestamps, duration):
     print(f"mean offered load: {10**9/mean_delay} req/s")
     seconds = [i*STEP_NANO/(10**9) for i in range(N_WINDOWS)]
 
+    # Aggregates only cover the steady-state windows [lo, hi). Either trim a 
+    # fixed warmup/cooldown (in seconds) or detect it from the throughput.
+    n_valid = min(window_idx, N_WINDOWS)
+    if warmup is not None or cooldown is not None:
+        method = "fixed"
+        lo = 1 + int(round((warmup or 0)*10**9/STEP_NANO))
+        hi = min(N_WINDOWS - int(round((cooldown or 0)*10**9/STEP_NANO)), n_valid)
+    else:
+        method = "auto"
+        lo, hi = steady_state(throughput, n_valid, steady_window, steady_tolerance)
+
+    if lo >= hi:
+        lo, hi = 1, max(n_valid, 2)
+
+    # Latencies are attributed to the window the request started in.
+    total_latencies = np.array(total_latencies)
+    starts = timestamps[:len(total_latencies), 0]
+    in_steady = (starts > START_NANO + (lo - 1)*STEP_NANO) & (starts <= START_NANO + (hi - 1)*STEP_NANO)
+    steady_latencies = total_latencies[in_steady] if np.any(in_steady) else total_latencies
+
     aggregate_data = {
         "latency": {
-            "p99": float(np.percentile(total_latencies, 99)),
-            "p90": float(np.percentile(total_latencies, 90)),
-            "p50": float(np.percentile(total_latencies, 50))
+            "p99": float(np.percentile(steady_latencies, 99)),
+            "p90": float(np.percentile(steady_latencies, 90)),
+            "p50": float(np.percentile(steady_latencies, 50))
         },
 
         "throughput": {
-            "p50": float(np.percentile(throughput, 50)),
-            "p10": float(np.percentile(throughput, 10)),
-            "p1": float(np.percentile(throughput, 1))
+            "p50": float(np.percentile(throughput[lo:hi], 50)),
+            "p10": float(np.percentile(throughput[lo:hi], 10)),
+            "p1": float(np.percentile(throughput[lo:hi], 1))
         },
 
         "outstanding": {
-            "p99": float(np.percentile(outstanding, 99)),
-            "p90": float(np.percentile(outstanding, 90)),
-            "p50": float(np.percentile(outstanding, 50)),
+            "p99": float(np.percentile(outstanding[lo:hi], 99)),
+            "p90": float(np.percentile(outstanding[lo:hi], 90)),
+            "p50": float(np.percentile(outstanding[lo:hi], 50)),
         }
     }
 
@@ -145,7 +335,180 @@ def process_timeseries(timestamps, duration):
         "throughput": [float(n) for n in throughput],
         "p99": [float(n) for n in p99_latency],
         "p90": [float(n) for n in p90_latency],
-        "p50": [float(n) for n in p50_latency]
+        "p50": [float(n) for n in p50_latency],
+        "steady-state": {
+            "start": float(seconds[lo - 1]),
+            "end": float(seconds[hi - 1]),
+            "method": method
+        }
     }
 
+    # If the trace says which workload node issued each request, break the
+    # series down per node as well.
+    if node_names is not None and timestamps.shape[1] > 2:
+        data["nodes"] = node_timeseries(timestamps, START_NANO, N_WINDOWS, node_names)
+
     return data, aggregate_data
+
+
+def align_samples(sample_ts, values, start_nano, n_windows):
+
+    # Line up samples taken at arbitrary times (e.g. scraped server metrics)
+    # with the windows produced by process_timeseries. Every window gets the 
+    # last sample taken at or before the window's end; windows before the first
+    # sample are NaN.
+    sample_ts = np.asarray(sample_ts)
+    values = np.asarray(values, dtype=float)
+    ends = start_nano + np.arange(n_windows)*STEP_NANO
+
+    idx = np.searchsorted(sample_ts, ends, side="right") - 1
+    aligned = np.full(n_windows, np.nan)
+    aligned[idx >= 0] = values[idx[idx >= 0]]
+
+    return aligned
+
+
+def host_timeseries(path, start_nano, n_windows):
+
+    # Turn a binary log written by hostsample.py into per-window resource
+    # usage: CPU utilization and iowait (%), disk read/write throughput (MB/s),
+    # disk utilization (%) and network receive/transmit throughput (MB/s).
+    dtype = np.dtype([(f, "<u8") for f in FIELDS])
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    # The sampler may have been killed halfway through writing a record.
+    samples = np.frombuffer(raw[:len(raw) - len(raw) % dtype.itemsize], dtype=dtype)
+    if len(samples) < 2:
+        return {}
+
+    # Counters only mean something as differences between consecutive samples.
+    # Each rate is attributed to the end of the interval it was measured over.
+    delta = {f: np.diff(samples[f].astype(np.int64)) for f in FIELDS}
+    seconds = delta["ts"]/10**9
+
+    cpu_total = sum(delta[f] for f in FIELDS if f.startswith("cpu_"))
+    cpu_total = np.maximum(cpu_total, 1)
+    cpu_idle = delta["cpu_idle"] + delta["cpu_iowait"]
+
+    rates = {
+        "cpu": 100*(1 - cpu_idle/cpu_total),
+        "iowait": 100*delta["cpu_iowait"]/cpu_total,
+        "disk_read": delta["disk_read_sectors"]*512/seconds/10**6,
+        "disk_write": delta["disk_write_sectors"]*512/seconds/10**6,
+        "disk_util": 100*delta["disk_io_ms"]/(seconds*1000),
+        "net_rx": delta["net_rx_bytes"]/seconds/10**6,
+        "net_tx": delta["net_tx_bytes"]/seconds/10**6,
+    }
+
+    data = {}
+    for stat, values in rates.items():
+        series = align_samples(samples["ts"][1:], values, start_nano, n_windows)
+        data[stat] = [float(n) for n in series]
+
+    return data
+
+
+def bootstrap_ci(samples, confidence=0.95, n_resamples=10000):
+
+    # Bootstrap confidence interval for the mean of a handful of samples (in
+    # practice, one aggregate statistic from each repeat of a workload). All
+    # resamples are drawn at once as an (n_resamples, n) index matrix, so this
+    # is a single NumPy gather + mean rather than a Python loop.
+    samples = np.asarray(samples, dtype=float)
+    rng = np.random.default_rng()
+    idx = rng.integers(0, len(samples), size=(n_resamples, len(samples)))
+    means = samples[idx].mean(axis=1)
+
+    tail = (1 - confidence)/2*100
+    lo, hi = np.percentile(means, [tail, 100 - tail])
+
+    return float(lo), float(hi)
+
+
+def permutation_test(a, b, n_permutations=10000, batch=1000):
+
+    # Two-sided p-value for the difference in means between samples a and b.
+    # Each batch of permutations is a (batch, len(a) + len(b)) matrix that is
+    # shuffled row-wise in one call, which keeps memory bounded for long
+    # per-window series.
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    pooled = np.concatenate([a, b])
+    observed = abs(b.mean() - a.mean())
+
+    rng = np.random.default_rng()
+    extreme = 0
+    for done in range(0, n_permutations, batch):
+        n = min(batch, n_permutations - done)
+        perms = rng.permuted(np.tile(pooled, (n, 1)), axis=1)
+        diffs = perms[:, len(a):].mean(axis=1) - perms[:, :len(a)].mean(axis=1)
+        extreme += int(np.sum(np.abs(diffs) >= observed))
+
+    return (extreme + 1)/(n_permutations + 1)
+
+
+def permutation_min_p(n, m, n_permutations=10000):
+
+    # Smallest p-value permutation_test can return for samples of sizes n and
+    # m. There are only C(n+m, n) distinct splits (and when n == m, each
+    # split and its mirror image give the same |difference|), so e.g. 3 vs. 3
+    # samples can never get below 2/20 = 0.1.
+    splits = math.comb(n + m, n)
+    exact = (2 if n == m else 1)/splits
+
+    return max(exact, 1/(n_permutations + 1))
+
+
+def block_means(series, block):
+
+    # Means of consecutive, non-overlapping blocks of a per-window series
+    # (any leftover windows at the end are dropped). Neighbouring 100ms 
+    # windows are strongly correlated, so tests should treat whole blocks, not
+    # single windows, as the independent samples.
+    series = np.asarray(series, dtype=float)
+    n_blocks = len(series)//block
+
+    return series[:n_blocks*block].reshape(n_blocks, block).mean(axis=1)
+
+
+def merge_repeats(repeats, stats, confidence=0.95):
+
+    # Given the aggregate_data of every repeat of a workload, return the mean
+    # aggregate (same layout as a single aggregate_data) along with bootstrap
+    # intervals for every statistic in stats. Stats are named like
+    # "latency.p99".
+    merged = {}
+    for stat, percentiles in repeats[0].items():
+        merged[stat] = {}
+        for percentile in percentiles:
+            values = [r[stat][percentile] for r in repeats]
+            merged[stat][percentile] = float(np.mean(values))
+
+    intervals = {}
+    for name in stats:
+        stat, percentile = name.split(".")
+        values = [r[stat][percentile] for r in repeats]
+
+        if stat not in intervals:
+            intervals[stat] = {}
+
+        intervals[stat][percentile] = list(bootstrap_ci(values, confidence))
+
+    return merged, intervals
+
+
+def intervals_converged(merged, intervals, target_width):
+
+    # True if every interval is narrower than target_width, relative to the
+    # mean it was computed for.
+    for stat, percentiles in intervals.items():
+        for percentile, (lo, hi) in percentiles.items():
+            mean = merged[stat][percentile]
+            if mean == 0:
+                if hi - lo > 0:
+                    return False
+            elif (hi - lo)/abs(mean) > target_width:
+                return False
+
+    return True
@@ -1,14 +1,157 @@
+import argparse
+import hashlib
 import os
-N_NODES = 24
+import subprocess
+import sys
+import time
+import yaml
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 ROACHDIR = "~/go/src/github.com/cockroachdb/cockroach"
+REMOTE_PATH = "/usr/local/bin/cockroach"
+
+def local_checksum(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+def remote_checksum(node, path=REMOTE_PATH):
+    # None if the node doesn't have the file (or we can't reach it).
+    result = subprocess.run(["sudo", "ssh", f"root@{node}", f"sha256sum {path}"],
+        capture_output=True, text=True)
+
+    if result.returncode != 0 or len(result.stdout.split()) == 0:
+        return None
+
+    return result.stdout.split()[0]
+
+def send(src, dst, binary, checksum):
+
+    # Copy the binary to dst, either from this machine (src is None) or from a
+    # node that already has it. There are root SSH keys between every node, so
+    # the node-to-node copy doesn't have to go through us. We copy to a
+    # temporary name and only rename it into place once its checksum matches,
+    # so a failed copy (or a stale temporary file from an earlier run) never 
+    # replaces a working binary. Returns how long it took, or None if the copy
+    # failed.
+    tmp = REMOTE_PATH + ".tmp"
+    begin = time.monotonic()
+
+    subprocess.run(["sudo", "ssh", f"root@{dst}", f"rm -f {tmp}"])
+
+    if src is None:
+        result = subprocess.run(["sudo", "scp", "-q", binary, f"root@{dst}:{tmp}"])
+    else:
+        result = subprocess.run(["sudo", "ssh", f"root@{src}",
+            f"scp -q -o StrictHostKeyChecking=no {REMOTE_PATH} root@{dst}:{tmp}"])
+
+    if result.returncode != 0 or remote_checksum(dst, tmp) != checksum:
+        subprocess.run(["sudo", "ssh", f"root@{dst}", f"rm -f {tmp}"])
+        return None
+
+    result = subprocess.run(["sudo", "ssh", f"root@{dst}", f"chmod +x {tmp} && mv {tmp} {REMOTE_PATH}"])
+    if result.returncode != 0:
+        return None
+
+    return time.monotonic() - begin
+
+def distribute(pending, sources, binary, checksum, concurrency):
+
+    # Copy the binary to every pending node as a tree: each source sends to
+    # one node at a time, and every node that finishes becomes a source too,
+    # so the number of senders roughly doubles each round. At most
+    # concurrency copies run at once. Returns {node: (source, seconds)};
+    # seconds is None if the copy failed.
+    results = {}
+    idle = list(sources)
+    pending = list(pending)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        running = {}
+
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(idle) > 0 and len(running) < concurrency:
+                src = idle.pop(0)
+                dst = pending.pop(0)
+                running[pool.submit(send, src, dst, binary, checksum)] = (src, dst)
+
+            # Every source is busy or dead; nothing left to do but wait.
+            if len(running) == 0:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                src, dst = running.pop(future)
+                seconds = future.result()
+                results[dst] = (src, seconds)
+
+                idle.append(src)
+                if seconds is not None:
+                    idle.append(dst)
+
+    # Only reachable if every source failed.
+    for dst in pending:
+        results[dst] = (None, None)
+
+    return results
 
 def main():
-    # move binary from build directory into /usr/local/bin, here and on
-    # all the other nodes.
-    #os.system("sudo cp {}/cockroach /usr/local/bin".format(ROACHDIR))
+    parser = argparse.ArgumentParser(description="Install the cockroach binary on every node in config.yaml.")
+
+    parser.add_argument("--binary", default=f"{ROACHDIR}/cockroach",
+    help="binary to install")
+
+    parser.add_argument("--config", default="config.yaml",
+    help="config file to read the node list from")
+
+    parser.add_argument("--concurrency", type=int, default=8,
+    help="maximum number of copies in flight")
+
+    args = parser.parse_args()
+
+    with open(args.config) as conf_file:
+        conf = yaml.full_load(conf_file)
+
+    # Workload nodes need the binary too, for "cockroach workload".
+    nodes = conf["nodes"] + [n for n in conf.get("workload-nodes", []) if n not in conf["nodes"]]
+
+    binary = os.path.expanduser(args.binary)
+    checksum = local_checksum(binary)
+    print(f"{binary}: sha256 {checksum}")
+
+    with ThreadPoolExecutor(max_workers=len(nodes)) as pool:
+        installed = dict(zip(nodes, pool.map(remote_checksum, nodes)))
+
+    # Nodes that already have this build are skipped, and they start out as
+    # sources alongside this machine.
+    up_to_date = [node for node in nodes if installed[node] == checksum]
+    pending = [node for node in nodes if installed[node] != checksum]
+
+    begin = time.monotonic()
+    results = distribute(pending, [None] + up_to_date, binary, checksum, args.concurrency)
+    total = time.monotonic() - begin
+
+    failed = 0
+    for node in nodes:
+        if node in up_to_date:
+            print(f"{node:<16}up to date")
+            continue
+
+        src, seconds = results[node]
+        if seconds is None:
+            print(f"{node:<16}FAILED")
+            failed += 1
+        else:
+            print(f"{node:<16}{seconds:>8.2f}s  from {src or 'local'}")
+
+    print(f"installed on {len(pending) - failed} node(s), skipped {len(up_to_date)}, "
+        f"{failed} failed, in {total:.2f}s")
 
-    for i in range(N_NODES):
-        os.system("sudo scp {}/cockroach root@node-{}:/usr/local/bin".format(ROACHDIR, str(i)))
+    if failed > 0:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
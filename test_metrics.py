@@ -0,0 +1,111 @@
+import threading
+import time
+import numpy as np
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from metrics import MetricsScraper, parse_prometheus
+
+class FakeNode(BaseHTTPRequestHandler):
+
+    # Stand-in for a node's /_status/vars: a counter that goes up by 10 on
+    # every scrape, a gauge split over two stores, and a metric we don't ask
+    # for.
+    scrapes = 0
+
+    def do_GET(self):
+        FakeNode.scrapes += 1
+        body = "\n".join([
+            "# HELP sys_gc_count Total number of GC runs",
+            "# TYPE sys_gc_count counter",
+            f"sys_gc_count {10*FakeNode.scrapes}",
+            "# TYPE replicas gauge",
+            'replicas{store="1"} 2',
+            'replicas{store="2"} 3',
+            "other 9",
+        ])
+
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+def test_parse_prometheus():
+    text = "# TYPE a counter\n# TYPE b gauge\na 1\nb{store=\"1\"} 2\nb{store=\"2\"} 3\nc 4\n"
+    values, counters = parse_prometheus(text, {"a", "b"})
+
+    assert values == {"a": 1.0, "b": 5.0}
+    assert counters == {"a"}
+
+def test_scraper_against_local_server():
+    server = HTTPServer(("127.0.0.1", 0), FakeNode)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        scraper = MetricsScraper(["127.0.0.1"], ["sys_gc_count", "replicas"],
+            interval=0.05, port=server.server_port)
+
+        start = time.time_ns()
+        scraper.start()
+        time.sleep(0.5)
+        scraper.stop()
+    finally:
+        server.shutdown()
+
+    assert len(scraper.samples["127.0.0.1"]) >= 3
+    assert scraper.counters == {"sys_gc_count"}
+
+    data = scraper.aligned(start, 6)["127.0.0.1"]
+
+    # Gauges are stored as-is, counters as per-second rates (10 per scrape,
+    # one scrape every ~50ms, so somewhere around 200/s).
+    replicas = np.array(data["replicas"])
+    gc_rate = np.array(data["sys_gc_count"])
+
+    assert np.all(replicas[~np.isnan(replicas)] == 5)
+    assert np.all(np.isnan(gc_rate[:1]))
+    assert np.all((gc_rate[2:] > 50) & (gc_rate[2:] < 400))
+
+class BrokenNode(BaseHTTPRequestHandler):
+
+    # Alternates between a garbled value and a response that promises more
+    # bytes than it sends.
+    scrapes = 0
+
+    def do_GET(self):
+        BrokenNode.scrapes += 1
+        self.send_response(200)
+
+        if BrokenNode.scrapes % 2 == 0:
+            self.end_headers()
+            self.wfile.write(b"sys_gc_count not-a-number\n")
+        else:
+            self.send_header("Content-Length", "1000")
+            self.end_headers()
+            self.wfile.write(b"sys_gc_count 1\n")
+            self.wfile.flush()
+            self.connection.shutdown(2)
+
+    def log_message(self, *args):
+        pass
+
+def test_scraper_survives_bad_responses():
+    server = HTTPServer(("127.0.0.1", 0), BrokenNode)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        scraper = MetricsScraper(["127.0.0.1"], ["sys_gc_count"],
+            interval=0.05, port=server.server_port)
+
+        scraper.start()
+        time.sleep(0.4)
+
+        # Still polling after several bad scrapes.
+        assert scraper.thread.is_alive()
+        assert BrokenNode.scrapes >= 4
+        scraper.stop()
+    finally:
+        server.shutdown()
+
+    assert scraper.samples["127.0.0.1"] == []
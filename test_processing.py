@@ -0,0 +1,61 @@
+import numpy as np
+
+from processing import grouped_percentiles, latency_heatmap, process_timeseries
+
+def test_grouped_percentiles():
+    rng = np.random.default_rng(0)
+    groups = rng.integers(0, 5, 1000)
+    groups[groups == 3] = 4
+    values = rng.exponential(10, 1000)
+
+    result = grouped_percentiles(groups, values, 6, [99, 50, 0])
+
+    for g in range(6):
+        for q in [99, 50, 0]:
+            expected = np.percentile(values[groups == g], q) if np.any(groups == g) else 0
+            assert np.isclose(result[q][g], expected)
+
+def test_single_node_matches_global():
+
+    # 5s at ~1000 req/s from one node, with ~60ms latencies so most requests
+    # finish a few windows after they start. Broken down per node, the one
+    # node's series should be the global series.
+    rng = np.random.default_rng(0)
+    n = 5000
+    start = 10**18 + np.sort(rng.uniform(0, 5*10**9, n))
+    start[0] = 10**18
+    finish = start + np.clip(rng.normal(60, 20, n), 1, None)*10**6
+
+    timestamps = np.column_stack([start, finish, np.zeros(n)])
+    data, _ = process_timeseries(timestamps, 5, ["n1"])
+    node = data["nodes"]["n1"]
+
+    for series in ["p99", "p90", "p50", "throughput"]:
+        assert np.allclose(node[series], data[series])
+
+    # process_timeseries closes its last window early, on the last request.
+    assert node["outstanding"][:-1] == data["outstanding"][:-1]
+
+def test_heatmap_overflow_keeps_unfinished_requests():
+
+    # 5 windows of 100ms, buckets 0.1-1-10-100-1000ms. A 5ms and a 10ms
+    # request, one that never finishes, one that finishes long after the run,
+    # and one that starts after the last window.
+    start = 10**18
+    timestamps = np.array([
+        [start, start + 5*10**6],
+        [start + 10**8, np.inf],
+        [start + 2.5*10**8, start + 100*10**9],
+        [start + 3.5*10**8, start + 3.6*10**8],
+        [start + 10**9, np.inf],
+    ], dtype=float)
+
+    counts, edges = latency_heatmap(timestamps, start, 5, 4, 0.1, 1000)
+
+    assert counts.shape == (5, 5)
+    assert counts[1, 1] == 1 and counts[4, 2] == 1
+
+    # The unfinished and late requests are in the overflow bucket of the
+    # window they started in.
+    assert counts[1, -1] == 1 and counts[3, -1] == 1
+    assert counts.sum() == 4
@@ -5,6 +5,7 @@ import glob
 import random
 import matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
 import os
 import re
 import string
@@ -31,10 +32,46 @@ def get_filepaths(rx):
     return glob.glob(os.path.join("", rx))
 
 
-def plot_ts_stat(workload, ts_stat):
+def selected_metrics(workload, metrics):
 
-    fig = plt.figure()
-    axes = plt.axes()
+    # Names of the scraped server metrics to plot. An empty list means "all of
+    # them"; None means none.
+    if metrics is None or "metrics" not in workload["ts"]:
+        return []
+
+    names = set()
+    for node_metrics in workload["ts"]["metrics"].values():
+        names |= set(node_metrics.keys())
+
+    return sorted(n for n in names if len(metrics) == 0 or n in metrics)
+
+
+def plot_metrics(all_axes, workload, names):
+
+    # One axis per metric (their scales differ by orders of magnitude), with a
+    # line per node. Counters were stored as per-second rates.
+    seconds = workload["ts"]["seconds"]
+    rates = workload["ts"].get("metric-rates", [])
+
+    for axes, metric in zip(all_axes, names):
+        for node, node_metrics in workload["ts"]["metrics"].items():
+            if metric in node_metrics:
+                line, = axes.plot(seconds, node_metrics[metric], linewidth=0.8)
+                line.set_label(node)
+
+        axes.set_ylabel(f"{metric} (/s)" if metric in rates else metric, fontsize="x-small")
+        axes.legend(loc="upper right", fontsize="xx-small")
+        axes.grid()
+
+
+def plot_ts_stat(workload, ts_stat, metrics=None):
+
+    # Server metrics, if requested, go in their own panels under the main one.
+    names = selected_metrics(workload, metrics)
+    fig, all_axes = plt.subplots(1 + len(names), 1, sharex=True, squeeze=False,
+        figsize=(6.4, 4.8 + 1.6*len(names)))
+    all_axes = all_axes[:, 0]
+    axes = all_axes[0]
 
     seconds = workload["ts"]["seconds"]
     rate = workload["flags"]["max-rate"]
@@ -69,6 +106,114 @@ def plot_ts_stat(workload, ts_stat):
 
     axes.grid()
 
+    # Shade the interval the aggregates were computed over.
+    if "steady-state" in workload["ts"]:
+        steady = workload["ts"]["steady-state"]
+        axes.axvspan(steady["start"], steady["end"], color="#7F7F7F", alpha=0.15)
+
+    plot_metrics(all_axes[1:], workload, names)
+
+    return fig
+
+
+def plot_host_stats(workload):
+
+    # One panel each for CPU, disk and network usage, with a line per node.
+    fig, (cpu_axes, disk_axes, net_axes) = plt.subplots(3, 1, sharex=True, figsize=(6.4, 7.2))
+
+    seconds = workload["ts"]["seconds"]
+    rate = workload["flags"]["max-rate"]
+
+    for node, host in workload["ts"].get("hosts", {}).items():
+        if len(host) == 0:
+            continue
+
+        line, = cpu_axes.plot(seconds, host["cpu"])
+        line.set_label(node)
+        disk_axes.plot(seconds, host["disk_read"], color=line.get_color(), linestyle="--")
+        disk_axes.plot(seconds, host["disk_write"], color=line.get_color())
+        net_axes.plot(seconds, host["net_rx"], color=line.get_color(), linestyle="--")
+        net_axes.plot(seconds, host["net_tx"], color=line.get_color())
+
+    cpu_axes.set_title(f"host resources vs. time for max-rate={rate}")
+    cpu_axes.set(ylabel="CPU utilization (%)")
+    cpu_axes.legend(loc="upper left", fontsize="xx-small")
+    disk_axes.set(ylabel="disk read (--) / \n write (MB/s)")
+    net_axes.set(xlabel="time (s)", ylabel="net rx (--) / \n tx (MB/s)")
+
+    for axes in (cpu_axes, disk_axes, net_axes):
+        axes.grid()
+
+    return fig
+
+
+def plot_node_stats(workload):
+
+    # Throughput, p99 latency and outstanding requests side by side, with a
+    # line per workload node, so a slow or skewed client stands out.
+    fig, (tput_axes, lat_axes, out_axes) = plt.subplots(1, 3, figsize=(12.8, 4.0))
+
+    seconds = workload["ts"]["seconds"]
+    rate = workload["flags"]["max-rate"]
+
+    for node, node_ts in workload["ts"].get("nodes", {}).items():
+        line, = tput_axes.plot(seconds, node_ts["throughput"])
+        line.set_label(node)
+        lat_axes.plot(seconds, node_ts["p99"], color=line.get_color())
+        out_axes.plot(seconds, node_ts["outstanding"], color=line.get_color())
+
+    tput_axes.set(xlabel="time (s)", ylabel=STAT_LABELS["throughput"])
+    tput_axes.legend(loc="lower right", fontsize="xx-small")
+    lat_axes.set(xlabel="time (s)", ylabel="p99 " + STAT_LABELS["latency"])
+    lat_axes.set_title(f"per-node timeseries for max-rate={rate}")
+    out_axes.set(xlabel="time (s)", ylabel=STAT_LABELS["outstanding"])
+
+    for axes in (tput_axes, lat_axes, out_axes):
+        axes.grid()
+
+    return fig
+
+
+def plot_latency_heatmap(workload, exp_dir):
+
+    # Render the stored (window x latency bucket) counts directly; we never
+    # touch the raw trace, so this is fast no matter how many requests the run
+    # had.
+    fig = plt.figure()
+    axes = plt.axes()
+
+    rate = workload["flags"]["max-rate"]
+    heatmap = np.load(os.path.join(exp_dir, workload["ts"]["heatmap"]))
+    counts = heatmap["counts"]
+
+    # Window k covers ((k-1)*step, k*step].
+    step = workload["ts"]["seconds"][1]
+    time_edges = (np.arange(counts.shape[0] + 1) - 1)*step
+
+    # The last column is the overflow bucket (slower than the top edge). Draw
+    # it as a band above the others, past a dashed line, and label it so it
+    # can't be mistaken for requests at the top edge. The band's height means
+    # nothing; it's just tall enough to see.
+    edges = heatmap["edges"]
+    overflow = counts.shape[1] == len(edges)
+    if overflow:
+        edges = np.append(edges, edges[-1]*2)
+
+    # Empty cells are left blank rather than forced onto the log scale.
+    counts = np.ma.masked_equal(counts, 0)
+    mesh = axes.pcolormesh(time_edges, edges, counts.T, 
+        norm=matplotlib.colors.LogNorm(), cmap="viridis")
+    fig.colorbar(mesh, ax=axes, label="# requests")
+
+    axes.set_yscale("log")
+
+    if overflow:
+        axes.axhline(edges[-2], color="#CD0000", linestyle="--", linewidth=0.8)
+        axes.text(time_edges[0], edges[-2], f" > {edges[-2]:g} ms", color="#CD0000",
+            fontsize="x-small", va="bottom")
+    axes.set_title(f"latency distribution vs. time for max-rate={rate}")
+    axes.set(xlabel="time (s)", ylabel=STAT_LABELS["latency"])
+
     return fig
 
 
@@ -87,6 +232,18 @@ def main():
     parser.add_argument("-outstanding", action="store_true",
     help="produce a graph of outstanding requests")
 
+    parser.add_argument("-heatmap", action="store_true",
+    help="produce a latency heatmap")
+
+    parser.add_argument("-nodes", action="store_true",
+    help="produce side-by-side per-workload-node graphs")
+
+    parser.add_argument("-host", action="store_true",
+    help="produce a graph of per-node CPU, disk and network usage")
+
+    parser.add_argument("-metrics", nargs="*",
+    help="plot scraped server metrics under each graph (all of them if no names are given)")
+
     parser.add_argument("--show", action="store_true",
     help="show graphs on the screen")
 
@@ -101,7 +258,10 @@ def main():
     # graphing throughput (since that's the most common use-case).
     latency = args.latency
     outstanding = args.outstanding
-    throughput = args.throughput or not (latency or outstanding)
+    host = args.host
+    nodes = args.nodes
+    heatmap = args.heatmap
+    throughput = args.throughput or not (latency or outstanding or host or nodes or heatmap)
     show = args.show
     save = args.save
 
@@ -124,7 +284,7 @@ def main():
         if throughput:
             img_name = fname.replace("/", "-")[:-5] + "-throughput.png" # ignore the ".yaml" at the end
 
-            fig = plot_ts_stat(workload, "throughput")    
+            fig = plot_ts_stat(workload, "throughput", args.metrics)    
             plt.tight_layout()
             plt.title(args.title)
 
@@ -135,7 +295,7 @@ def main():
         if latency:
             img_name = fname.replace("/", "-")[:-5] + "-latency.png"
 
-            fig = plot_ts_stat(workload, "latency")    
+            fig = plot_ts_stat(workload, "latency", args.metrics)    
             plt.tight_layout()
             plt.title(args.title)
 
@@ -147,7 +307,7 @@ def main():
         if outstanding:
             img_name = fname.replace("/", "-")[:-5] + "-outstanding.png"
 
-            fig = plot_ts_stat(workload, "outstanding")    
+            fig = plot_ts_stat(workload, "outstanding", args.metrics)    
             plt.tight_layout()
             plt.title(args.title)
 
@@ -155,6 +315,36 @@ def main():
                 fig.savefig(img_name)
                 print(f"graph saved as {img_name}")
 
+        if heatmap:
+            img_name = fname.replace("/", "-")[:-5] + "-heatmap.png"
+
+            fig = plot_latency_heatmap(workload, os.path.dirname(fname))
+            plt.tight_layout()
+
+            if save:
+                fig.savefig(img_name)
+                print(f"graph saved as {img_name}")
+
+        if nodes:
+            img_name = fname.replace("/", "-")[:-5] + "-nodes.png"
+
+            fig = plot_node_stats(workload)
+            plt.tight_layout()
+
+            if save:
+                fig.savefig(img_name)
+                print(f"graph saved as {img_name}")
+
+        if host:
+            img_name = fname.replace("/", "-")[:-5] + "-host.png"
+
+            fig = plot_host_stats(workload)
+            plt.tight_layout()
+
+            if save:
+                fig.savefig(img_name)
+                print(f"graph saved as {img_name}")
+
         if show:
             plt.show()
 